@@ -1,40 +1,66 @@
 from __future__ import annotations
 
 import argparse
+import functools
 import json
 import os
 import sys
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from sx_search import engine as bm25tool
+from sx_search.constants import DEFAULT_DB_PATH, DEFAULT_EXTS
 
+if TYPE_CHECKING:
+    from sx_search.engine import SearchHit
 
-def parse_exts(s: str | None) -> set[str]:
+# The engine (sqlite3, re, concurrent.futures) and the daemon are imported
+# inside the cmd_* functions so `sx --help` and argument errors stay fast.
+
+
+@functools.lru_cache(maxsize=32)
+def parse_exts(s: str | None) -> frozenset[str]:
+    # Cached per raw --ext string; frozenset keeps the shared result immutable.
     if not s:
-        return set(bm25tool.DEFAULT_EXTS)
-    exts = set()
-    for part in s.split(","):
-        p = part.strip().lower()
-        if not p:
-            continue
-        exts.add(p)
-    return exts
+        return frozenset(DEFAULT_EXTS)
+    # Drop all whitespace up front instead of strip()-ing every field.
+    return frozenset(p for p in "".join(s.lower().split()).split(",") if p)
+
+
+@functools.lru_cache(maxsize=64)
+def _read_text(path: str) -> str:
+    from sx_search import engine as bm25tool
+
+    # Hits that share a file (e.g. the same path across search-batch queries)
+    # read it once; the small maxsize bounds memory for large files.
+    return bm25tool.read_text(Path(path))
+
+
+def _snippet(root: str, h: SearchHit, q_terms: list[str]) -> tuple[int | None, str]:
+    from sx_search import engine as bm25tool
+
+    return bm25tool.snippet_from_text(_read_text(str(Path(root) / h.path)), q_terms)
 
 
 def cmd_index(args: argparse.Namespace) -> int:
+    from sx_search import engine as bm25tool
+
     opts = bm25tool.IndexOptions(
         exts=parse_exts(args.ext),
         stem=args.stem,
         stopwords=not args.no_stopwords,
         workers=args.workers,
     )
-    stats = bm25tool.index(
-        db_path=Path(args.out),
-        root=Path(args.root),
-        opts=opts,
-        incremental=not args.full,
-        progress=not args.no_progress,
-    )
+    try:
+        stats = bm25tool.index(
+            db_path=Path(args.out),
+            root=Path(args.root),
+            opts=opts,
+            incremental=not args.full,
+            progress=not args.no_progress,
+        )
+    except bm25tool.IndexVersionError as e:
+        print(f"{args.out}: {e}", file=sys.stderr)
+        return 1
     print(
         "Indexed {indexed} docs (unchanged {unchanged}, removed {removed}, failed {failed}); total {total_docs} (avgdl {avgdl:.1f}) -> {out}".format(
             **stats, out=args.out
@@ -44,8 +70,11 @@ def cmd_index(args: argparse.Namespace) -> int:
 
 
 def cmd_search(args: argparse.Namespace) -> int:
+    from sx_search import daemon
+    from sx_search import engine as bm25tool
+
     exts = parse_exts(args.ext) if args.ext else None
-    root, hits = bm25tool.search(
+    search_args = dict(
         db_path=Path(args.index),
         query=args.query,
         k=args.k,
@@ -57,6 +86,13 @@ def cmd_search(args: argparse.Namespace) -> int:
         path_filter=args.path,
         exts_filter=exts,
     )
+    # A running `sx daemon` already has the index open; use it when reachable.
+    res = daemon.remote_search(daemon.socket_path(), **search_args)
+    try:
+        root, hits = res if res is not None else bm25tool.search(**search_args)
+    except bm25tool.IndexVersionError as e:
+        print(str(e), file=sys.stderr)
+        return 1
     if not hits:
         print("No results.")
         return 1
@@ -64,45 +100,111 @@ def cmd_search(args: argparse.Namespace) -> int:
     q_terms = bm25tool.tokenize(
         args.query,
         stem=args.stem,
-        stopwords=(bm25tool.DEFAULT_STOPWORDS if not args.no_stopwords else set()),
+        stopwords=(bm25tool.DEFAULT_STOPWORDS if not args.no_stopwords else frozenset()),
     )
     color = args.color and sys.stdout.isatty()
+    q_re = bm25tool.terms_pattern(q_terms) if color else None
 
     if args.json:
-        out = []
-        for h in hits:
-            p = Path(root) / h.path
-            line_no, snip = (None, "")
-            if args.snippet:
-                line_no, snip = bm25tool.snippet_with_line(p, q_terms)
-            out.append(
-                {
-                    "score": h.score,
-                    "path": h.path,
-                    "line": line_no,
-                    "snippet": snip,
-                }
-            )
-        print(json.dumps(out, indent=2))
+        # Stream the array one hit at a time so snippets are never all held in
+        # memory at once. Output matches json.dumps(list_of_hits, indent=2).
+        write = sys.stdout.write
+        write("[\n")
+        for i, h in enumerate(hits):
+            item = json.dumps(_hit_json(root, h, q_terms, snippet=args.snippet), indent=2)
+            if i:
+                write(",\n")
+            write("  " + item.replace("\n", "\n  "))
+        write("\n]\n")
+        sys.stdout.flush()
         return 0
 
+    # Format every hit first and emit them with a single write, rather than
+    # one or two print() calls (and stream lock/flush checks) per hit.
+    lines: list[str] = []
     for rank, h in enumerate(hits, 1):
-        p = Path(root) / h.path
         line_no, snip = (None, "")
         if args.snippet:
-            line_no, snip = bm25tool.snippet_with_line(p, q_terms)
-            snip = bm25tool.highlight(snip, q_terms, color=color)
+            line_no, snip = _snippet(root, h, q_terms)
+            snip = bm25tool.highlight(snip, q_terms, color=color, pattern=q_re)
 
         loc = h.path
         if line_no is not None:
             loc = f"{loc}:{line_no}"
-        print(f"{rank:>2}. {h.score:>8.4f}  {loc}")
+        lines.append(f"{rank:>2}. {h.score:>8.4f}  {loc}")
         if snip:
-            print(f"    {snip}")
+            lines.append(f"    {snip}")
+    lines.append("")
+    sys.stdout.write("\n".join(lines))
+    return 0
+
+
+def _hit_json(root: str, h: SearchHit, q_terms: list[str], *, snippet: bool) -> dict:
+    line_no, snip = (None, "")
+    if snippet:
+        line_no, snip = _snippet(root, h, q_terms)
+    return {
+        "score": h.score,
+        "path": h.path,
+        "line": line_no,
+        "snippet": snip,
+    }
+
+
+def cmd_search_batch(args: argparse.Namespace) -> int:
+    from sx_search import engine as bm25tool
+
+    # One query per stdin line; one JSON object per query on stdout.
+    queries = [line.strip() for line in sys.stdin]
+    queries = [q for q in queries if q]
+    exts = parse_exts(args.ext) if args.ext else None
+    try:
+        root, results = bm25tool.search_batch(
+            db_path=Path(args.index),
+            queries=queries,
+            k=args.k,
+            k1=args.k1,
+            b=args.b,
+            stem=args.stem,
+            stopwords=not args.no_stopwords,
+            path_boost=args.path_boost,
+            path_filter=args.path,
+            exts_filter=exts,
+        )
+    except bm25tool.IndexVersionError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    sw = bm25tool.DEFAULT_STOPWORDS if not args.no_stopwords else frozenset()
+    for query, hits in zip(queries, results):
+        q_terms = bm25tool.tokenize(query, stem=args.stem, stopwords=sw)
+        out = {
+            "query": query,
+            "hits": [_hit_json(root, h, q_terms, snippet=args.snippet) for h in hits],
+        }
+        print(json.dumps(out))
+    return 0
+
+
+def cmd_daemon(args: argparse.Namespace) -> int:
+    from sx_search import daemon
+
+    if not daemon.available():
+        print("sx daemon needs Unix-domain sockets, which this platform lacks.", file=sys.stderr)
+        return 2
+    path = os.path.expanduser(args.socket) if args.socket else daemon.socket_path()
+    try:
+        server = daemon.make_server(path)
+    except RuntimeError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(f"Serving searches on {path} (Ctrl-C to stop)", file=sys.stderr)
+    daemon.serve_until_interrupted(server, path)
     return 0
 
 
 def cmd_status(args: argparse.Namespace) -> int:
+    from sx_search import engine as bm25tool
+
     info = bm25tool.index_status(db_path=Path(args.index), cwd=Path.cwd())
     if info["indexed"]:
         print(
@@ -123,9 +225,12 @@ def cmd_status(args: argparse.Namespace) -> int:
     return 1
 
 
+SUBCOMMANDS = frozenset({"index", "search", "search-batch", "daemon", "status"})
+
+
 def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(prog="sx", add_help=True)
-    p.add_argument("--index", default=bm25tool.DEFAULT_DB_PATH, help=f"Index DB path (default: {bm25tool.DEFAULT_DB_PATH})")
+    p.add_argument("--index", default=DEFAULT_DB_PATH, help=f"Index DB path (default: {DEFAULT_DB_PATH})")
     p.add_argument("--k", type=int, default=10, help="Top K results (default: 10)")
     p.add_argument("--k1", type=float, default=1.2, help="BM25 k1 (default: 1.2)")
     p.add_argument("--b", type=float, default=0.75, help="BM25 b (default: 0.75)")
@@ -141,7 +246,7 @@ def build_parser() -> argparse.ArgumentParser:
     sub = p.add_subparsers(dest="cmd")
     p_index = sub.add_parser("index", help="Build/update index")
     p_index.add_argument("root", nargs="?", default=".", help="Root directory to index (default: .)")
-    p_index.add_argument("--out", default=bm25tool.DEFAULT_DB_PATH, help=f"Output DB path (default: {bm25tool.DEFAULT_DB_PATH})")
+    p_index.add_argument("--out", default=DEFAULT_DB_PATH, help=f"Output DB path (default: {DEFAULT_DB_PATH})")
     p_index.add_argument("--ext", default=None, help="Comma-separated extensions/names to index (e.g. .c,.h,.md,makefile)")
     p_index.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Indexing workers")
     p_index.add_argument("--full", action="store_true", help="Full reindex (ignore incremental checks)")
@@ -154,6 +259,13 @@ def build_parser() -> argparse.ArgumentParser:
     p_search.add_argument("query", help="Query string")
     p_search.set_defaults(func=cmd_search)
 
+    p_batch = sub.add_parser("search-batch", help="Run newline-delimited queries from stdin (JSON lines out)")
+    p_batch.set_defaults(func=cmd_search_batch)
+
+    p_daemon = sub.add_parser("daemon", help="Keep indexes open and serve searches over a Unix socket")
+    p_daemon.add_argument("--socket", default=None, help="Socket path (default: $SX_SOCKET or ~/.cache/sx/search.sock)")
+    p_daemon.set_defaults(func=cmd_daemon)
+
     p_status = sub.add_parser("status", help="Check whether current directory is covered by the index")
     p_status.set_defaults(func=cmd_status)
     return p
@@ -162,11 +274,12 @@ def build_parser() -> argparse.ArgumentParser:
 def main(argv: list[str] | None = None) -> int:
     if argv is None:
         argv = sys.argv
-    p = build_parser()
 
-    # Support: sx "terms" (plus global flags).
+    # Support: sx "terms" (plus global flags). The full subcommand parser is
+    # only built when it is actually needed; the shorthand query is the common
+    # case and goes straight to cmd_search.
     global_p = argparse.ArgumentParser(prog="sx", add_help=False)
-    global_p.add_argument("--index", default=bm25tool.DEFAULT_DB_PATH)
+    global_p.add_argument("--index", default=DEFAULT_DB_PATH)
     global_p.add_argument("--k", type=int, default=10)
     global_p.add_argument("--k1", type=float, default=1.2)
     global_p.add_argument("--b", type=float, default=0.75)
@@ -182,9 +295,10 @@ def main(argv: list[str] | None = None) -> int:
 
     g, rest = global_p.parse_known_args(argv[1:])
     if g.help:
-        p.parse_args(["--help"])
+        build_parser().parse_args(["--help"])
         return 0
-    if rest and rest[0] in {"index", "search", "status"}:
+    if rest and rest[0] in SUBCOMMANDS:
+        p = build_parser()
         args = p.parse_args(argv[1:])
         if not hasattr(args, "func"):
             p.print_help()
@@ -212,7 +326,7 @@ def main(argv: list[str] | None = None) -> int:
         )
         return cmd_search(ns)
 
-    p.print_help()
+    build_parser().print_help()
     return 2
 
 
@@ -0,0 +1,40 @@
+"""Defaults shared by the CLI and the engine.
+
+Kept free of imports so `sx --help` and argument parsing never load sqlite3 or
+the engine.
+"""
+
+DEFAULT_DB_PATH = "bm25.sqlite"
+
+
+DEFAULT_EXTS = {
+    ".c",
+    ".h",
+    ".cpp",
+    ".cc",
+    ".hpp",
+    ".py",
+    ".go",
+    ".rs",
+    ".java",
+    ".js",
+    ".ts",
+    ".tsx",
+    ".jsx",
+    ".sh",
+    ".zsh",
+    ".bash",
+    ".md",
+    ".txt",
+    ".rst",
+    ".toml",
+    ".yaml",
+    ".yml",
+    ".json",
+    ".ini",
+    ".cfg",
+    ".conf",
+    ".mk",
+    ".make",
+    "makefile",
+}
@@ -0,0 +1,175 @@
+"""Long-running search server for `sx daemon`.
+
+The daemon keeps one SearchContext open per index and answers newline-delimited
+JSON requests over a Unix-domain socket, so repeated searches skip interpreter
+start-up, imports and opening the index. `sx "query"` forwards to it whenever
+the socket exists and falls back to searching locally otherwise.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import socketserver
+import stat
+from pathlib import Path
+from typing import AbstractSet, Any, Dict, List, Optional, Tuple
+
+from sx_search.engine import DEFAULT_B, DEFAULT_K1, SearchContext, SearchHit
+
+
+DEFAULT_SOCKET_PATH = os.path.join("~", ".cache", "sx", "search.sock")
+
+
+def socket_path() -> str:
+    """Socket used by both the daemon and the CLI client (override with SX_SOCKET)."""
+    return os.path.expanduser(os.environ.get("SX_SOCKET") or DEFAULT_SOCKET_PATH)
+
+
+def available() -> bool:
+    return hasattr(socket, "AF_UNIX")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "_Server"
+    # Connections are served one at a time (the SearchContexts belong to the
+    # serving thread), so a client that goes quiet is dropped well before the
+    # 5 s timeout of the clients queued behind it.
+    timeout = 1.0
+
+    def handle(self) -> None:
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    resp = self.server.answer(json.loads(line))
+                except Exception as e:  # report, keep serving
+                    resp = {"error": f"{type(e).__name__}: {e}"}
+                self.wfile.write(json.dumps(resp).encode("utf-8") + b"\n")
+                self.wfile.flush()
+        except (socket.timeout, BrokenPipeError, ConnectionResetError):
+            # Idle client, or one that hung up before reading its answer.
+            pass
+
+
+class _Server(socketserver.UnixStreamServer):
+    def __init__(self, path: str) -> None:
+        super().__init__(path, _Handler)
+        self.contexts: Dict[str, SearchContext] = {}
+
+    def answer(self, req: Dict[str, Any]) -> Dict[str, Any]:
+        db_path = str(req["db_path"])
+        ctx = self.contexts.get(db_path)
+        if ctx is None:
+            ctx = self.contexts[db_path] = SearchContext(Path(db_path))
+        exts = req.get("exts_filter")
+        root, hits = ctx.search(
+            str(req["query"]),
+            k=int(req.get("k", 10)),
+            k1=float(req.get("k1", DEFAULT_K1)),
+            b=float(req.get("b", DEFAULT_B)),
+            stem=bool(req.get("stem", False)),
+            stopwords=bool(req.get("stopwords", True)),
+            path_boost=float(req.get("path_boost", 1.5)),
+            path_filter=req.get("path_filter"),
+            exts_filter=frozenset(exts) if exts else None,
+        )
+        return {
+            "root": root,
+            "hits": [{"score": h.score, "path": h.path, "docid": h.docid} for h in hits],
+        }
+
+    def server_close(self) -> None:
+        super().server_close()
+        for ctx in self.contexts.values():
+            ctx.close()
+        self.contexts.clear()
+
+
+def _claim_socket(path: str) -> None:
+    # Refuse to start over a live daemon; clear a stale socket file.
+    if not os.path.exists(path):
+        Path(path).parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        return
+    if not stat.S_ISSOCK(os.lstat(path).st_mode):
+        raise RuntimeError(f"{path} exists and is not a socket")
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        s.close()
+    raise RuntimeError(f"a daemon is already listening on {path}")
+
+
+def make_server(path: str) -> _Server:
+    _claim_socket(path)
+    return _Server(path)
+
+
+def serve_until_interrupted(server: _Server, path: str) -> None:
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def remote_search(
+    path: str,
+    *,
+    db_path: Path,
+    query: str,
+    k: int,
+    k1: float,
+    b: float,
+    stem: bool,
+    stopwords: bool,
+    path_boost: float,
+    path_filter: Optional[str],
+    exts_filter: Optional[AbstractSet[str]],
+) -> Optional[Tuple[str, List[SearchHit]]]:
+    """
+    Ask the daemon on `path` to run a search. Returns None when no daemon is
+    reachable (or it reports an error) so the caller can search locally.
+    """
+    if not available() or not os.path.exists(path):
+        return None
+    req = {
+        "db_path": str(Path(db_path).resolve()),
+        "query": query,
+        "k": k,
+        "k1": k1,
+        "b": b,
+        "stem": stem,
+        "stopwords": stopwords,
+        "path_boost": path_boost,
+        "path_filter": path_filter,
+        "exts_filter": sorted(exts_filter) if exts_filter else None,
+    }
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(5.0)
+            s.connect(path)
+            s.sendall(json.dumps(req).encode("utf-8") + b"\n")
+            with s.makefile("rb") as f:
+                line = f.readline()
+    except OSError:
+        return None
+    try:
+        resp = json.loads(line)
+    except ValueError:
+        return None
+    if "error" in resp:
+        return None
+    hits = [SearchHit(score=float(h["score"]), path=str(h["path"]), docid=int(h["docid"])) for h in resp["hits"]]
+    return (str(resp["root"]), hits)
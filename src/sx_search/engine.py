@@ -1,21 +1,38 @@
 from __future__ import annotations
 
+import atexit
+import contextlib
+import functools
 import hashlib
+import itertools
 import math
+import mmap
+import multiprocessing
 import os
 import re
 import sqlite3
 import sys
+import threading
 import time
 import shutil
-from collections import Counter, defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from dataclasses import dataclass
+from collections import Counter, OrderedDict
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    BrokenExecutor,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from typing import AbstractSet, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
+from sx_search.constants import DEFAULT_DB_PATH, DEFAULT_EXTS
 
-DEFAULT_DB_PATH = "bm25.sqlite"
+# Bytes of the index file SQLite may memory-map for reads.
+MMAP_SIZE = 256 * 1024 * 1024
 
 
 SKIP_DIRS = {
@@ -34,40 +51,7 @@ SKIP_DIRS = {
 }
 
 
-DEFAULT_EXTS = {
-    ".c",
-    ".h",
-    ".cpp",
-    ".cc",
-    ".hpp",
-    ".py",
-    ".go",
-    ".rs",
-    ".java",
-    ".js",
-    ".ts",
-    ".tsx",
-    ".jsx",
-    ".sh",
-    ".zsh",
-    ".bash",
-    ".md",
-    ".txt",
-    ".rst",
-    ".toml",
-    ".yaml",
-    ".yml",
-    ".json",
-    ".ini",
-    ".cfg",
-    ".conf",
-    ".mk",
-    ".make",
-    "makefile",
-}
-
-
-DEFAULT_STOPWORDS = {
+DEFAULT_STOPWORDS = frozenset({
     "a",
     "an",
     "and",
@@ -123,39 +107,26 @@ DEFAULT_STOPWORDS = {
     "with",
     "you",
     "your",
-}
+})
+_EMPTY_SW: AbstractSet[str] = frozenset()
 
 
-_WORD_RE = re.compile(r"[A-Za-z0-9_]{2,}")
-
-
-def _split_identifier(token: str) -> List[str]:
-    # Split snake_case and camelCase-ish tokens.
-    parts: List[str] = []
-    for p in token.split("_"):
-        if not p:
-            continue
-        # Split camel case boundaries: "RedisModule_Load" -> ["Redis", "Module", "Load"]
-        start = 0
-        for i in range(1, len(p)):
-            c0 = p[i - 1]
-            c1 = p[i]
-            if c0.islower() and c1.isupper():
-                parts.append(p[start:i])
-                start = i
-            elif c0.isalpha() and c1.isdigit():
-                parts.append(p[start:i])
-                start = i
-            elif c0.isdigit() and c1.isalpha():
-                parts.append(p[start:i])
-                start = i
-        parts.append(p[start:])
-    return [x for x in parts if len(x) >= 2]
+# Sub-tokens in a single regex pass: words are runs of [A-Za-z0-9_], split on
+# "_", on lower->Upper ("RedisModule_Load" -> "Redis", "Module", "Load") and on
+# letter<->digit boundaries, keeping parts of 2+ chars. An upper-case run stays
+# with the lower-case letters after it ("HTTPConnection" is one token).
+_SUBTOKEN_RE = re.compile(r"[A-Z]{2,}[a-z]*|[A-Z][a-z]+|[a-z]{2,}|[0-9]{2,}")
+# The same pattern over raw file bytes. It only matches ASCII, and in UTF-8 an
+# ASCII byte is always a character of its own (even in invalid sequences), so
+# it finds exactly the tokens _SUBTOKEN_RE finds in the decoded text.
+_SUBTOKEN_BYTES_RE = re.compile(_SUBTOKEN_RE.pattern.encode("ascii"))
 
 
+@functools.lru_cache(maxsize=131072)
 def simple_stem(term: str) -> str:
     # Very small, dependency-free stemmer. Off by default.
     # Not Porter; just enough to reduce obvious English variants.
+    # Cached: a corpus repeats a small vocabulary, so most calls are repeats.
     t = term
     if len(t) <= 3:
         return t
@@ -169,19 +140,50 @@ def simple_stem(term: str) -> str:
     return t
 
 
-def tokenize(text: str, *, stem: bool = False, stopwords: Optional[set[str]] = None) -> List[str]:
-    out: List[str] = []
-    sw = stopwords or set()
-    for m in _WORD_RE.finditer(text):
-        tok = m.group(0)
-        for part in _split_identifier(tok):
-            t = part.lower()
-            if stem:
-                t = simple_stem(t)
-            if len(t) < 2 or t in sw:
-                continue
-            out.append(t)
-    return out
+def tokenize(text: str, *, stem: bool = False, stopwords: Optional[AbstractSet[str]] = None) -> List[str]:
+    sw = stopwords or _EMPTY_SW
+    # findall() builds the match strings in C; no Match object per token.
+    toks: Iterable[str] = map(str.lower, _SUBTOKEN_RE.findall(text))
+    if stem:
+        toks = map(simple_stem, toks)
+    return [t for t in toks if len(t) >= 2 and t not in sw]
+
+
+def tokenize_count(
+    text: str, *, stem: bool = False, stopwords: Optional[AbstractSet[str]] = None
+) -> Tuple[int, Dict[str, int]]:
+    """
+    (doc length, term frequencies) for `text`, tokenized exactly like
+    tokenize(). Counting runs in C via Counter over the raw sub-tokens; stemming
+    and stopword removal then touch each distinct term once instead of every
+    occurrence.
+    """
+    return _finish_counts(Counter(map(str.lower, _SUBTOKEN_RE.findall(text))), stem, stopwords)
+
+
+def _count_subtokens_bytes(data: Union[bytes, mmap.mmap]) -> Dict[str, int]:
+    # Lowered sub-token counts straight from file bytes: no decode of the whole
+    # file, and only each distinct raw token is lowered and turned into a str.
+    counts: Dict[str, int] = {}
+    for tok, c in Counter(_SUBTOKEN_BYTES_RE.findall(data)).items():
+        t = tok.lower().decode("ascii")
+        counts[t] = counts.get(t, 0) + c
+    return counts
+
+
+def _finish_counts(
+    counts: Dict[str, int], stem: bool, stopwords: Optional[AbstractSet[str]]
+) -> Tuple[int, Dict[str, int]]:
+    # Stem and filter lowered sub-token counts; see tokenize_count().
+    if stem:
+        stemmed: Dict[str, int] = {}
+        for t, c in counts.items():
+            st = simple_stem(t)
+            stemmed[st] = stemmed.get(st, 0) + c
+        counts = stemmed
+    for t in [t for t in counts if len(t) < 2 or (stopwords and t in stopwords)]:
+        del counts[t]
+    return sum(counts.values()), dict(counts)
 
 
 def is_probably_text_file(path: Path) -> bool:
@@ -193,26 +195,95 @@ def is_probably_text_file(path: Path) -> bool:
         return False
 
 
-def should_index_file(path: Path, exts: set[str]) -> bool:
+def should_index_file(path: Path, exts: AbstractSet[str]) -> bool:
     name = path.name.lower()
     suf = path.suffix.lower()
     return (name in exts) or (suf in exts)
 
 
-def iter_files(root: Path, exts: set[str]) -> Iterator[Path]:
-    for dirpath, dirnames, filenames in os.walk(root):
-        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS and not d.startswith(".")]
-        for fn in filenames:
-            if fn.startswith("."):
-                continue
-            p = Path(dirpath) / fn
-            if not p.is_file():
-                continue
-            if not should_index_file(p, exts):
-                continue
-            if not is_probably_text_file(p):
-                continue
-            yield p
+# Source/text extensions whose files are read without the up-front null-byte
+# probe. If such a file has NULs in its first 8 KiB anyway, the worker skips
+# tokenizing it and it is recorded as an empty (zero-length) doc.
+_KNOWN_TEXT_EXTS = frozenset({
+    ".py",
+    ".md",
+    ".txt",
+    ".rst",
+    ".toml",
+    ".yaml",
+    ".yml",
+    ".json",
+    ".ini",
+    ".cfg",
+    ".c",
+    ".h",
+    ".cpp",
+    ".js",
+    ".ts",
+    ".go",
+    ".rs",
+    ".java",
+    ".sh",
+})
+
+
+def _scan_files(root: Path, exts: AbstractSet[str]) -> Iterator[Tuple[str, Tuple[int, int]]]:
+    """
+    Walk `root` (which must already be resolved) with os.scandir and yield
+    (relative path, (mtime, size)) for each indexable file. Entry types come
+    from the directory read, so each candidate costs a single stat(), and that
+    stat is handed back for the incremental check instead of being redone.
+    Recurses top-down like os.walk, never into symlinked directories.
+    """
+    root_s = str(root)
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            it = os.scandir(os.path.join(root_s, rel_dir) if rel_dir else root_s)
+        except OSError:
+            continue
+        subdirs: List[str] = []
+        with it:
+            for entry in it:
+                name = entry.name
+                if name.startswith("."):
+                    continue
+                rel = os.path.join(rel_dir, name) if rel_dir else name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if name not in SKIP_DIRS:
+                            subdirs.append(rel)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    # Same test as should_index_file(), on the name string
+                    # rather than a Path built for every entry.
+                    lname = name.lower()
+                    dot = lname.rfind(".")
+                    suf = lname[dot:] if 0 < dot < len(lname) - 1 else ""
+                    if lname not in exts and suf not in exts:
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if entry.is_symlink():
+                    # Index a symlinked file under its target's path, and only
+                    # when that target lives inside the root.
+                    try:
+                        rel = str(Path(entry.path).resolve().relative_to(root))
+                    except (OSError, ValueError):
+                        continue
+                if suf not in _KNOWN_TEXT_EXTS and not is_probably_text_file(Path(entry.path)):
+                    continue
+                yield rel, _stat_sig(st)
+        stack.extend(reversed(subdirs))
+
+
+def iter_files(root: Path, exts: AbstractSet[str]) -> Iterator[Path]:
+    root = root.resolve()
+    for rel, _ in _scan_files(root, exts):
+        yield root / rel
 
 
 def read_text(path: Path) -> str:
@@ -222,28 +293,61 @@ def read_text(path: Path) -> str:
         return ""
 
 
+def _stat_sig(st: os.stat_result) -> Tuple[int, int]:
+    # Nanosecond mtime, so an edit that keeps the size within the same second
+    # still counts as a change (filesystems without ns timestamps just round).
+    return (st.st_mtime_ns, int(st.st_size))
+
+
 def file_sig(path: Path) -> Tuple[int, int]:
-    st = path.stat()
-    # ns mtime is nicer but not always available; int seconds is fine.
-    return (int(st.st_mtime), int(st.st_size))
+    return _stat_sig(path.stat())
 
 
-def sha1_bytes(data: bytes) -> str:
-    return hashlib.sha1(data).hexdigest()
+_FADV_SEQUENTIAL = getattr(os, "POSIX_FADV_SEQUENTIAL", None)
 
 
-def sha1_file(path: Path) -> str:
-    h = hashlib.sha1()
-    try:
-        with path.open("rb") as f:
-            while True:
-                b = f.read(1024 * 1024)
-                if not b:
-                    break
-                h.update(b)
-        return h.hexdigest()
-    except OSError:
-        return ""
+def read_file_bytes(path: Path) -> bytes:
+    # Whole-file reads for tokenizing: hint sequential access so the kernel
+    # reads ahead aggressively (posix_fadvise is POSIX-only; skipped elsewhere).
+    with open(path, "rb") as f:
+        if _FADV_SEQUENTIAL is not None:
+            try:
+                os.posix_fadvise(f.fileno(), 0, 0, _FADV_SEQUENTIAL)
+            except OSError:
+                pass
+        return f.read()
+
+
+# Files at least this large are mapped rather than read, so hashing and
+# tokenizing work straight from the page cache without a full bytes copy.
+_MMAP_MIN_SIZE = 256 * 1024
+
+
+def _read_and_count(path: Path, size: int) -> Tuple[str, Dict[str, int]]:
+    # (sha1, lowered sub-token counts); no tokens when the first 8 KiB contain
+    # a NUL byte. Files are tokenized as bytes and never decoded.
+    if size >= _MMAP_MIN_SIZE:
+        with open(path, "rb") as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                mm = None
+            if mm is not None:
+                with mm:
+                    if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                        mm.madvise(mmap.MADV_SEQUENTIAL)
+                    sha1 = hashlib.sha1(mm).hexdigest()
+                    if b"\x00" in mm[:8192]:
+                        return sha1, {}
+                    return sha1, _count_subtokens_bytes(mm)
+    data = read_file_bytes(path)
+    if b"\x00" in data[:8192]:
+        return sha1_bytes(data), {}
+    return sha1_bytes(data), _count_subtokens_bytes(data)
+
+
+def sha1_bytes(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
 
 
 @dataclass
@@ -263,10 +367,13 @@ def _connect(db_path: Path) -> sqlite3.Connection:
     db_path.parent.mkdir(parents=True, exist_ok=True)
     con = sqlite3.connect(str(db_path))
     # Pragmas chosen for "fast enough" without surprising durability tradeoffs.
-    con.execute("PRAGMA foreign_keys=ON;")
     con.execute("PRAGMA busy_timeout=5000;")
     # Avoid temp files for GROUP BY / sorting where possible (more portable).
     con.execute("PRAGMA temp_store=MEMORY;")
+    # Read pages straight out of the OS page cache through a memory map instead
+    # of copying them in with read(). SQLite ignores this where mmap is
+    # unavailable and caps it at its compile-time limit.
+    con.execute(f"PRAGMA mmap_size={MMAP_SIZE};")
     # WAL is great, but some filesystems/sandboxes don't support it reliably.
     try:
         con.execute("PRAGMA journal_mode=WAL;")
@@ -276,40 +383,131 @@ def _connect(db_path: Path) -> sqlite3.Connection:
     return con
 
 
+# Page cache SQLite may use while bulk writing (negative = KiB): 256 MiB.
+BULK_CACHE_SIZE = -256 * 1024
+
+
+@contextlib.contextmanager
+def _bulk_pragmas(con: sqlite3.Connection) -> Iterator[None]:
+    # Skip fsyncs and give the pager a large cache for the indexing writes,
+    # then put the connection back the way it was. The index can always be
+    # rebuilt from the source tree, so losing the last writes to a power cut
+    # is acceptable; WAL stays on so concurrent searches keep working.
+    saved = [(name, con.execute(f"PRAGMA {name}").fetchone()[0]) for name in ("synchronous", "cache_size")]
+    con.execute("PRAGMA synchronous=OFF")
+    con.execute(f"PRAGMA cache_size={BULK_CACHE_SIZE}")
+    try:
+        yield
+    finally:
+        if con.in_transaction:
+            # The block raised mid-write: drop its partial changes.
+            con.rollback()
+        for name, value in saved:
+            con.execute(f"PRAGMA {name}={int(value)}")
+
+
+# Bump whenever the docs/terms/postings layout changes. Databases written with
+# another version are reset by init_db() and rebuilt on the next `sx index`;
+# searching one raises IndexVersionError instead of touching it.
+SCHEMA_VERSION = "9"
+
+
+class IndexVersionError(RuntimeError):
+    """
+    The DB is not a usable sx index: searches raise it for an index in another
+    format (`sx index` rebuilds those), index() for a database sx didn't write.
+    """
+
+
+def _check_schema(con: sqlite3.Connection, db_path: Path) -> bool:
+    # Read-only check for search/status: True for a current index, False for
+    # an empty DB (nothing indexed yet), IndexVersionError for anything else.
+    tables = {str(r[0]) for r in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    if not tables:
+        return False
+    if "meta" in tables:
+        row = con.execute("SELECT v FROM meta WHERE k='version'").fetchone()
+        if row is not None and str(row[0]) == SCHEMA_VERSION:
+            return True
+    raise IndexVersionError(
+        f"{db_path} was not written by this version of sx (or is not an sx index); "
+        f"run `sx index` to rebuild it"
+    )
+
+
+# BM25 parameters the per-doc norm column is baked for at index time.
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+
+
 def init_db(con: sqlite3.Connection) -> None:
     """
     SQLite schema notes:
-      - docs: one row per file, keyed by integer docid.
-      - postings: one row per (term, docid) with tf.
-      - terms: df cache (derived from postings), rebuilt on index update.
+      - docs: one row per file, keyed by integer docid. name/ext hold the
+        lowercased file name and suffix so extension filters run in SQL;
+        path_tokens is space-separated and space-padded (" src acl ") so the
+        path boost is a plain instr() of " term "; norm is
+        k1*(1 - b + b*len/avgdl) for DEFAULT_K1/DEFAULT_B.
+      - terms: vocabulary, one row per distinct term with an integer
+        term_id, its df and its BM25 idf (both derived from postings and
+        refreshed on index update).
+      - postings: one row per (term_id, docid) with tf. Keying by the integer
+        id rather than the term text keeps each posting (and the primary-key
+        index over it) a few bytes instead of a copy of the string. tf is kept
+        exact: SQLite already stores integers up to 127 in one byte, which
+        covers nearly every posting, so quantizing it would save almost nothing.
+        The table is WITHOUT ROWID, so the primary key is the only b-tree
+        stored. There is no foreign key to docs: index() deletes a doc's
+        postings itself, which keeps inserts free of a docs lookup per row.
     """
+    tables = {str(r[0]) for r in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    row = con.execute("SELECT v FROM meta WHERE k='version'").fetchone() if "meta" in tables else None
+    if tables and row is None:
+        # Only an index written by some version of sx may be reset; never clear
+        # tables out of an unrelated database.
+        raise IndexVersionError("database is not an sx index; refusing to overwrite it")
+    con.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT NOT NULL)")
+    if row is None or str(row[0]) != SCHEMA_VERSION:
+        # Old layout (or brand-new file): drop index data so it gets rebuilt.
+        con.executescript(
+            """
+            DROP TABLE IF EXISTS postings;
+            DROP TABLE IF EXISTS terms;
+            DROP TABLE IF EXISTS docs;
+            DELETE FROM meta WHERE k IN ('root', 'total_docs', 'avgdl');
+            """
+        )
+        con.execute("INSERT OR REPLACE INTO meta(k,v) VALUES('version', ?)", (SCHEMA_VERSION,))
+        con.commit()
     con.executescript(
         """
-        CREATE TABLE IF NOT EXISTS meta (
-          k TEXT PRIMARY KEY,
-          v TEXT NOT NULL
-        );
         CREATE TABLE IF NOT EXISTS docs (
           docid INTEGER PRIMARY KEY,
           path TEXT NOT NULL UNIQUE,
+          name TEXT NOT NULL,
+          ext TEXT NOT NULL,
           len INTEGER NOT NULL,
           mtime INTEGER NOT NULL,
           size INTEGER NOT NULL,
           sha1 TEXT NOT NULL,
-          path_tokens TEXT NOT NULL
+          path_tokens TEXT NOT NULL,
+          norm REAL NOT NULL DEFAULT 0
         );
         CREATE TABLE IF NOT EXISTS terms (
-          term TEXT PRIMARY KEY,
-          df INTEGER NOT NULL
+          term_id INTEGER PRIMARY KEY,
+          term TEXT NOT NULL UNIQUE,
+          df INTEGER NOT NULL,
+          idf REAL NOT NULL DEFAULT 0
         );
         CREATE TABLE IF NOT EXISTS postings (
-          term TEXT NOT NULL,
+          term_id INTEGER NOT NULL,
           docid INTEGER NOT NULL,
           tf INTEGER NOT NULL,
-          PRIMARY KEY(term, docid),
-          FOREIGN KEY(docid) REFERENCES docs(docid) ON DELETE CASCADE
-        );
-        CREATE INDEX IF NOT EXISTS idx_postings_term ON postings(term);
+          PRIMARY KEY(term_id, docid)
+        ) WITHOUT ROWID;
+        -- PRIMARY KEY(term_id, docid) already serves term lookups; a separate
+        -- index on term alone only duplicated every posting on disk.
+        DROP INDEX IF EXISTS idx_postings_term;
         CREATE INDEX IF NOT EXISTS idx_docs_path ON docs(path);
         """
     )
@@ -320,14 +518,42 @@ def _doc_len(con: sqlite3.Connection) -> Tuple[int, float]:
     return (int(row[0]), float(row[1]))
 
 
-def _path_tokens(rel: str, *, stem: bool, stopwords: set[str]) -> List[str]:
+def _path_tokens(rel: str, *, stem: bool, stopwords: AbstractSet[str]) -> List[str]:
     return tokenize(rel.replace(os.sep, " "), stem=stem, stopwords=stopwords)
 
 
+_UPSERT_DOC_SQL = """
+    INSERT INTO docs(path, name, ext, len, mtime, size, sha1, path_tokens)
+    VALUES(?,?,?,?,?,?,?,?)
+    ON CONFLICT(path) DO UPDATE SET
+      len=excluded.len,
+      mtime=excluded.mtime,
+      size=excluded.size,
+      sha1=excluded.sha1,
+      path_tokens=excluded.path_tokens
+"""
+
+
+# RETURNING (SQLite 3.35+) hands back the upserted docid without a second query.
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def _upsert_doc(con: sqlite3.Connection, row: Tuple[object, ...]) -> int:
+    if _HAS_RETURNING:
+        return int(con.execute(_UPSERT_DOC_SQL + " RETURNING docid", row).fetchone()[0])
+    con.execute(_UPSERT_DOC_SQL, row)
+    return int(con.execute("SELECT docid FROM docs WHERE path=?", (row[0],)).fetchone()[0])
+
+
+def _doc_row(rel: str, dl: int, mtime: int, size: int, sha1: str, path_tokens: str) -> Tuple[object, ...]:
+    p = Path(rel)
+    return (rel, p.name.lower(), p.suffix.lower(), dl, int(mtime), int(size), sha1, f" {path_tokens} ")
+
+
 @dataclass(frozen=True)
-class _IndexTask:
+class _IndexConfig:
+    # Settings shared by every file of one index() run; sent once per chunk.
     root: str
-    rel: str
     stem: bool
     use_stopwords: bool
 
@@ -338,38 +564,78 @@ class _IndexedDoc:
     mtime: int
     size: int
     sha1: str
+    dl: int
     tf: Dict[str, int]
     path_tokens: List[str]
 
 
-def _index_one_file(task: _IndexTask) -> Optional[_IndexedDoc]:
-    # Runs in a worker thread: read + tokenize + tf.
-    root_s, rel, stem, use_stopwords = task.root, task.rel, task.stem, task.use_stopwords
-    path = Path(root_s) / rel
+def _index_one_file(cfg: _IndexConfig, rel: str) -> Optional[_IndexedDoc]:
+    # Runs in a worker process (or thread): read + tokenize + tf. A file with
+    # no tokens still comes back (with an empty tf) so the parent can record
+    # it without reading it again; None means it could not be read at all.
+    stem = cfg.stem
+    path = Path(cfg.root) / rel
     try:
         mtime, size = file_sig(path)
     except OSError:
         return None
     try:
-        data = path.read_bytes()
+        sha1, counts = _read_and_count(path, size)
     except OSError:
         return None
-    if b"\x00" in data[:8192]:
-        return None
-    sha1 = sha1_bytes(data)
-    text = data.decode("utf-8", errors="replace")
-    sw = DEFAULT_STOPWORDS if use_stopwords else set()
-    toks = tokenize(text, stem=stem, stopwords=sw)
-    if not toks:
-        return None
-    tf = Counter(toks)
+    sw = DEFAULT_STOPWORDS if cfg.use_stopwords else _EMPTY_SW
+    dl, tf = _finish_counts(counts, stem, sw)
     path_toks = _path_tokens(rel, stem=stem, stopwords=sw)
-    return _IndexedDoc(rel=rel, mtime=mtime, size=size, sha1=sha1, tf=dict(tf), path_tokens=path_toks)
+    return _IndexedDoc(rel=rel, mtime=mtime, size=size, sha1=sha1, dl=dl, tf=tf, path_tokens=path_toks)
+
+
+def _index_files(cfg: _IndexConfig, batch: Sequence[str]) -> List[Tuple[bool, Optional[_IndexedDoc]]]:
+    # One pool submission per chunk of files, so the per-task IPC round trip
+    # to a worker process is paid per chunk, and only the relative paths
+    # vary between submissions. (False, None) marks a file whose indexing
+    # raised.
+    out: List[Tuple[bool, Optional[_IndexedDoc]]] = []
+    for rel in batch:
+        try:
+            out.append((True, _index_one_file(cfg, rel)))
+        except Exception:
+            out.append((False, None))
+    return out
+
+
+# Below this many files, process startup costs more than it saves.
+_PROCESS_POOL_MIN_TASKS = 32
+# Files per process-pool submission: enough to amortize the IPC round trip,
+# few enough to keep progress output and load balancing fine-grained.
+_PROCESS_CHUNK = 8
+# fork starts workers fastest, but is only a safe default on Linux.
+_START_METHODS = ("fork", "spawn") if sys.platform.startswith("linux") else ("spawn",)
+
+
+def _gil_disabled() -> bool:
+    # Free-threaded builds (3.13+) run threads in parallel, so no processes needed.
+    is_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_enabled is not None and not is_enabled()
+
+
+def _index_executor(workers: int, n_tasks: int) -> Executor:
+    # Tokenizing is CPU-bound, so with a GIL worker threads mostly take turns;
+    # processes give real parallelism once there is enough work to repay their
+    # startup. Some environments (including sandboxes) restrict multiprocessing
+    # primitives like semaphores, so try each start method and fall back to
+    # threads when no pool can be made.
+    if workers > 1 and n_tasks >= _PROCESS_POOL_MIN_TASKS and not _gil_disabled():
+        for method in _START_METHODS:
+            try:
+                return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+            except (ImportError, NotImplementedError, OSError, ValueError):
+                continue
+    return ThreadPoolExecutor(max_workers=max(1, workers))
 
 
 @dataclass
 class IndexOptions:
-    exts: set[str]
+    exts: AbstractSet[str]
     stem: bool = False
     stopwords: bool = True
     workers: int = max(1, (os.cpu_count() or 2) - 1)
@@ -455,183 +721,221 @@ def index(
     db_path = Path(db_path)
 
     con = _connect(db_path)
-    init_db(con)
+    try:
+        init_db(con)
+    except IndexVersionError:
+        con.close()
+        raise
     con.execute("INSERT OR REPLACE INTO meta(k,v) VALUES('root', ?)", (str(root),))
-    con.execute("INSERT OR REPLACE INTO meta(k,v) VALUES('version', '2')")
     con.commit()
 
-    # Build set of candidate rel paths.
-    rels: List[str] = []
-    for p in iter_files(root, opts.exts):
-        try:
-            rels.append(str(p.resolve().relative_to(root)))
-        except Exception:
-            continue
-    prog = _Progress(enabled=progress, total=0)
-    if progress:
-        sys.stderr.write(f"scan: {len(rels)} candidate files under {root}\n")
-
     existing: Dict[str, Tuple[int, int, str, int]] = {}
     for row in con.execute("SELECT path, mtime, size, sha1, docid FROM docs"):
         existing[str(row[0])] = (int(row[1]), int(row[2]), str(row[3]), int(row[4]))
 
-    to_remove = set(existing.keys()) - set(rels)
-    to_consider = rels
-
+    # Candidate files are discovered lazily and handed to the workers as they
+    # are found, so walking the tree overlaps with tokenizing it.
+    seen: set[str] = set()
     to_index: List[str] = []
     unchanged = 0
 
-    if incremental:
-        for rel in to_consider:
-            p = root / rel
-            try:
-                mtime, size = file_sig(p)
-            except OSError:
-                continue
-            ex = existing.get(rel)
-            if ex and ex[0] == mtime and ex[1] == size:
-                unchanged += 1
+    cfg = _IndexConfig(root=str(root), stem=opts.stem, use_stopwords=opts.stopwords)
+
+    def gen_tasks() -> Iterator[str]:
+        nonlocal unchanged
+        for rel, (mtime, size) in _scan_files(root, opts.exts):
+            if rel in seen:
+                # A symlink to a file that is also indexed under its own path.
                 continue
+            seen.add(rel)
+            if incremental:
+                ex = existing.get(rel)
+                if ex and ex[0] == mtime and ex[1] == size:
+                    unchanged += 1
+                    continue
             # Even if the file changed, it may be empty/non-text and yield no tokens.
             # We still consider it "unchanged" for future runs by updating docs metadata.
             to_index.append(rel)
-    else:
-        to_index = list(to_consider)
+            yield rel
 
-    prog = _Progress(enabled=progress, total=len(to_index))
-    if progress:
-        sys.stderr.write(
-            f"plan: {len(to_index)} to index, {unchanged} unchanged, {len(to_remove)} to remove\n"
-        )
-
-    # Remove docs and their postings first (including stale docs).
-    if to_remove:
-        con.execute("BEGIN")
-        for rel in to_remove:
-            row = con.execute("SELECT docid FROM docs WHERE path=?", (rel,)).fetchone()
-            if not row:
-                continue
-            docid = int(row[0])
-            con.execute("DELETE FROM docs WHERE docid=?", (docid,))
-        con.execute("COMMIT")
-
-    # For changed docs, delete old postings and reinsert.
-    if to_index:
-        con.execute("BEGIN")
-        for rel in to_index:
-            row = con.execute("SELECT docid FROM docs WHERE path=?", (rel,)).fetchone()
-            if row:
-                con.execute("DELETE FROM postings WHERE docid=?", (int(row[0]),))
-        con.execute("COMMIT")
-
-    sw = DEFAULT_STOPWORDS if opts.stopwords else set()
+    prog = _Progress(enabled=progress, total=0)
+    sw = DEFAULT_STOPWORDS if opts.stopwords else _EMPTY_SW
 
     indexed = 0
     failed = 0
     skipped_empty = 0
     # Parallel content work, single-writer DB updates.
-    tasks = [_IndexTask(root=str(root), rel=rel, stem=opts.stem, use_stopwords=opts.stopwords) for rel in to_index]
     results: List[_IndexedDoc] = []
-    if tasks:
-        # Use threads instead of processes since some environments (including
-        # sandboxes) restrict multiprocessing primitives like semaphores.
-        with ThreadPoolExecutor(max_workers=opts.workers) as ex:
-            futs = [ex.submit(_index_one_file, t) for t in tasks]
-            for fut in as_completed(futs):
-                try:
-                    r = fut.result()
-                except Exception:
-                    failed += 1
-                    prog.update(inc_failed=1, phase="indexing")
-                    continue
-                if r is None:
-                    # File produced no tokens (empty / not decodable / binary). Update docs
-                    # metadata so incremental runs won't keep retrying it.
-                    skipped_empty += 1
-                    prog.update(inc_failed=1, phase="indexing")
-                    continue
-                results.append(r)
-                prog.update(inc_done=1, phase="indexing")
+    empty_docs: List[_IndexedDoc] = []
+
+    def collect(ex: Executor, tasks: Iterator[str], chunk: int) -> List[str]:
+        # Returns the tasks a broken pool never finished, for a retry on threads.
+        nonlocal failed, skipped_empty
+        broken: List[str] = []
+        # Bound the chunks in flight so discovery never runs far ahead of the
+        # workers (and pending results never pile up in memory).
+        max_pending = max(1, opts.workers) * 4
+        pending: Dict[Future[List[Tuple[bool, Optional[_IndexedDoc]]]], List[str]] = {}
+        submitting = True
+        with ex:
+            while True:
+                while submitting and len(pending) < max_pending:
+                    batch = list(itertools.islice(tasks, chunk))
+                    if not batch:
+                        break
+                    try:
+                        fut = ex.submit(_index_files, cfg, batch)
+                    except (BrokenExecutor, OSError):
+                        # A dead worker broke the pool, or no new process could
+                        # be started: hand this batch and the rest of the walk
+                        # back for the thread retry.
+                        broken.extend(batch)
+                        broken.extend(tasks)
+                        submitting = False
+                        break
+                    prog.total += len(batch)
+                    pending[fut] = batch
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    batch = pending.pop(fut)
+                    try:
+                        chunk_results = fut.result()
+                    except BrokenExecutor:
+                        broken.extend(batch)
+                        prog.total -= len(batch)
+                        continue
+                    except Exception:
+                        failed += len(batch)
+                        prog.update(inc_failed=len(batch), phase="indexing")
+                        continue
+                    for ok, r in chunk_results:
+                        if not ok:
+                            failed += 1
+                            prog.update(inc_failed=1, phase="indexing")
+                        elif r is None or not r.tf:
+                            # File produced no tokens (empty / unreadable / binary). Record its
+                            # metadata so incremental runs won't keep retrying it.
+                            skipped_empty += 1
+                            if r is not None:
+                                empty_docs.append(r)
+                            prog.update(inc_failed=1, phase="indexing")
+                        else:
+                            results.append(r)
+                            prog.update(inc_done=1, phase="indexing")
+        return broken
+
+    # Peek far enough into the walk to know whether a process pool pays off.
+    tasks = gen_tasks()
+    head = list(itertools.islice(tasks, _PROCESS_POOL_MIN_TASKS))
+    if head:
+        ex = _index_executor(opts.workers, len(head))
+        chunk = _PROCESS_CHUNK if isinstance(ex, ProcessPoolExecutor) else 1
+        leftover = collect(ex, itertools.chain(head, tasks), chunk)
+        if leftover:
+            collect(ThreadPoolExecutor(max_workers=opts.workers), iter(leftover), 1)
     prog.finish(phase="indexing")
 
-    if skipped_empty:
-        have = {d.rel for d in results}
+    to_remove = set(existing.keys()) - seen
+    if progress:
+        sys.stderr.write(
+            f"scan: {len(seen)} candidate files under {root}: {len(to_index)} indexed, "
+            f"{unchanged} unchanged, {len(to_remove)} to remove\n"
+        )
+
+    with _bulk_pragmas(con):
+        # Every write below is one transaction: docs, postings, df/idf, norm and
+        # meta change together or not at all. An interrupted run must not leave
+        # a doc whose stored mtime says "unchanged" without its postings, or new
+        # terms and docs with idf/norm still 0, since incremental runs would
+        # never revisit them.
         con.execute("BEGIN")
-        for rel in to_index:
-            if rel in have:
-                continue
-            # Store a zero-len doc record so incremental runs won't keep retrying
-            # files that yield no tokens (empty / whitespace-only / etc).
-            p = root / rel
-            try:
-                mtime, size = file_sig(p)
-            except OSError:
-                continue
-            sha1 = sha1_file(p)
-            path_tokens = " ".join(_path_tokens(rel, stem=opts.stem, stopwords=sw))
-            con.execute(
-                """
-                INSERT INTO docs(path, len, mtime, size, sha1, path_tokens)
-                VALUES(?,?,?,?,?,?)
-                ON CONFLICT(path) DO UPDATE SET
-                  len=excluded.len,
-                  mtime=excluded.mtime,
-                  size=excluded.size,
-                  sha1=excluded.sha1,
-                  path_tokens=excluded.path_tokens
-                """,
-                (rel, 0, int(mtime), int(size), sha1, path_tokens),
+        # Drop the postings of removed and changed docs, then the removed docs.
+        removed_ids = [existing[rel][3] for rel in to_remove]
+        if to_index and not incremental:
+            # A full rebuild replaces every doc's postings, so clear the table in
+            # one statement (SQLite truncates it) instead of deleting per doc.
+            con.execute("DELETE FROM postings")
+        else:
+            stale = removed_ids + [existing[rel][3] for rel in to_index if rel in existing]
+            if stale:
+                # postings is keyed by term first, so finding one doc's rows is
+                # a table scan; do a single scan for every stale doc at once.
+                con.execute("CREATE TEMP TABLE IF NOT EXISTS stale_docs (docid INTEGER PRIMARY KEY)")
+                con.executemany("INSERT OR IGNORE INTO stale_docs(docid) VALUES(?)", ((d,) for d in stale))
+                con.execute("DELETE FROM postings WHERE docid IN (SELECT docid FROM stale_docs)")
+                con.execute("DROP TABLE stale_docs")
+        con.executemany("DELETE FROM docs WHERE docid=?", ((d,) for d in removed_ids))
+
+        if empty_docs:
+            # Store zero-len doc records so incremental runs won't keep retrying
+            # files that yield no tokens (empty / whitespace-only / etc). The
+            # workers already took their signature and hash.
+            con.executemany(
+                _UPSERT_DOC_SQL,
+                (_doc_row(d.rel, 0, d.mtime, d.size, d.sha1, " ".join(d.path_tokens)) for d in empty_docs),
             )
-        con.execute("COMMIT")
 
-    if progress and results:
-        sys.stderr.write(f"db: writing {len(results)} docs\n")
-    con.execute("BEGIN")
-    for doc in results:
-        rel, mtime, size, sha1, tf, path_toks = (
-            doc.rel,
-            doc.mtime,
-            doc.size,
-            doc.sha1,
-            doc.tf,
-            doc.path_tokens,
-        )
-        dl = int(sum(tf.values()))
-        path_tokens = " ".join(path_toks)
-        con.execute(
-            """
-            INSERT INTO docs(path, len, mtime, size, sha1, path_tokens)
-            VALUES(?,?,?,?,?,?)
-            ON CONFLICT(path) DO UPDATE SET
-              len=excluded.len,
-              mtime=excluded.mtime,
-              size=excluded.size,
-              sha1=excluded.sha1,
-              path_tokens=excluded.path_tokens
-            """,
-            (rel, dl, int(mtime), int(size), sha1, path_tokens),
-        )
-        docid = int(con.execute("SELECT docid FROM docs WHERE path=?", (rel,)).fetchone()[0])
+        if progress and results:
+            sys.stderr.write(f"db: writing {len(results)} docs\n")
+        # Postings are staged with their term text and resolved to term ids in
+        # bulk once every doc is written, rather than one terms lookup per token.
+        # They are then inserted in primary-key order, so the postings B-tree is
+        # appended to page by page instead of being split at random positions.
+        con.execute("CREATE TEMP TABLE IF NOT EXISTS staged_postings (term TEXT NOT NULL, docid INTEGER NOT NULL, tf INTEGER NOT NULL)")
+        docids: List[int] = []
+        for doc in results:
+            path_tokens = " ".join(doc.path_tokens)
+            docids.append(_upsert_doc(con, _doc_row(doc.rel, doc.dl, doc.mtime, doc.size, doc.sha1, path_tokens)))
+        # Every doc's postings go through one executemany call.
         con.executemany(
-            "INSERT OR REPLACE INTO postings(term, docid, tf) VALUES(?,?,?)",
-            ((term, docid, int(freq)) for term, freq in tf.items() if term not in sw),
+            "INSERT INTO staged_postings(term, docid, tf) VALUES(?,?,?)",
+            (
+                (term, docid, int(freq))
+                for doc, docid in zip(results, docids)
+                for term, freq in doc.tf.items()
+                if term not in sw
+            ),
         )
-        indexed += 1
-    con.execute("COMMIT")
-
-    # Recompute df table from postings only if we changed anything.
-    if indexed or len(to_remove) or skipped_empty:
-        if progress:
-            sys.stderr.write("db: rebuilding term document-frequencies\n")
-        con.execute("BEGIN")
-        con.execute("DELETE FROM terms")
-        con.execute("INSERT INTO terms(term, df) SELECT term, COUNT(*) FROM postings GROUP BY term")
+        indexed = len(docids)
+        if indexed:
+            con.execute("INSERT OR IGNORE INTO terms(term, df) SELECT DISTINCT term, 0 FROM staged_postings")
+            con.execute(
+                """
+                INSERT OR REPLACE INTO postings(term_id, docid, tf)
+                SELECT t.term_id, s.docid, s.tf FROM staged_postings s JOIN terms t ON t.term = s.term
+                ORDER BY t.term_id, s.docid
+                """
+            )
+        con.execute("DROP TABLE staged_postings")
+
+        # Recompute df table from postings only if we changed anything.
+        if indexed or len(to_remove) or skipped_empty:
+            if progress:
+                sys.stderr.write("db: rebuilding term document-frequencies\n")
+            # term_ids must stay stable for the postings that reference them, so
+            # refresh df in place and only drop terms no posting uses any more.
+            con.execute("UPDATE terms SET df = (SELECT COUNT(*) FROM postings p WHERE p.term_id = terms.term_id)")
+            con.execute("DELETE FROM terms WHERE df = 0")
+
+        total_docs, avgdl = _doc_len(con)
+        if indexed or len(to_remove) or skipped_empty:
+            # idf only depends on df and the doc count, so it is computed once per
+            # index update here instead of once per query term at search time.
+            con.create_function("bm25_idf", 2, bm25_idf, deterministic=True)
+            con.execute("UPDATE terms SET idf = bm25_idf(?, df)", (total_docs,))
+            # avgdl moved, so refresh every doc's length-norm term for the default
+            # parameters; search() reads it instead of recomputing it per posting.
+            con.execute(
+                "UPDATE docs SET norm = ? + ? * MAX(len, 1)",
+                (DEFAULT_K1 * (1.0 - DEFAULT_B), DEFAULT_K1 * DEFAULT_B / (avgdl or 1.0)),
+            )
+            con.execute("INSERT OR REPLACE INTO meta(k,v) VALUES('norm_k1', ?)", (str(DEFAULT_K1),))
+            con.execute("INSERT OR REPLACE INTO meta(k,v) VALUES('norm_b', ?)", (str(DEFAULT_B),))
+        con.execute("INSERT OR REPLACE INTO meta(k,v) VALUES('avgdl', ?)", (str(avgdl),))
+        con.execute("INSERT OR REPLACE INTO meta(k,v) VALUES('total_docs', ?)", (str(total_docs),))
         con.execute("COMMIT")
-
-    total_docs, avgdl = _doc_len(con)
-    con.execute("INSERT OR REPLACE INTO meta(k,v) VALUES('avgdl', ?)", (str(avgdl),))
-    con.execute("INSERT OR REPLACE INTO meta(k,v) VALUES('total_docs', ?)", (str(total_docs),))
-    con.commit()
     con.close()
 
     return {
@@ -666,9 +970,19 @@ def index_status(*, db_path: Path, cwd: Path) -> Dict[str, object]:
 
     con = _connect(p)
     try:
-        init_db(con)
-        root = _get_meta(con, "root", "")
-        total_docs = int(_get_meta(con, "total_docs", "0") or "0")
+        try:
+            current = _check_schema(con, p)
+        except IndexVersionError as e:
+            return {
+                "exists": True,
+                "indexed": False,
+                "reason": str(e),
+                "db_path": str(p),
+                "root": None,
+                "total_docs": 0,
+            }
+        root = _get_meta(con, "root", "") if current else ""
+        total_docs = int(_get_meta(con, "total_docs", "0") or "0") if current else 0
     finally:
         con.close()
 
@@ -700,48 +1014,250 @@ def index_status(*, db_path: Path, cwd: Path) -> Dict[str, object]:
     }
 
 
+class SearchContext:
+    """
+    An index opened once for many searches (search-batch, the daemon).
+
+    Index metadata is re-read whenever another connection has committed to the
+    DB since the last query, and the file is reopened if it was replaced, so a
+    long-lived context keeps up with `sx index` runs. A DB in another format
+    raises IndexVersionError from searches and is left untouched.
+    """
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = Path(db_path)
+        self._open()
+
+    def _open(self) -> None:
+        self.con = _connect(self.db_path)
+        self._file_id = self._stat_id()
+        self._data_version: Optional[int] = None
+        self._meta: Optional[_SearchMeta] = None
+
+    def _stat_id(self) -> Tuple[int, int]:
+        try:
+            st = os.stat(self.db_path)
+        except OSError:
+            return (0, 0)
+        return (st.st_dev, st.st_ino)
+
+    def meta(self) -> _SearchMeta:
+        if self._stat_id() != self._file_id:
+            self.con.close()
+            self._open()
+        version = int(self.con.execute("PRAGMA data_version").fetchone()[0])
+        if self._meta is None or version != self._data_version:
+            self._meta = _search_meta(self.con, self.db_path)
+            self._data_version = version
+        return self._meta
+
+    @property
+    def root(self) -> str:
+        return self.meta().root
+
+    def search(
+        self,
+        query: str,
+        *,
+        k: int = 10,
+        k1: float = DEFAULT_K1,
+        b: float = DEFAULT_B,
+        stem: bool = False,
+        stopwords: bool = True,
+        path_boost: float = 1.5,
+        path_filter: Optional[str] = None,
+        exts_filter: Optional[AbstractSet[str]] = None,
+    ) -> Tuple[str, List[SearchHit]]:
+        meta = self.meta()
+        if meta.total_docs <= 0:
+            return (meta.root, [])
+        hits = _search_con(
+            self.con,
+            query,
+            meta,
+            k=k,
+            k1=k1,
+            b=b,
+            stem=stem,
+            stopwords=stopwords,
+            path_boost=path_boost,
+            path_filter=path_filter,
+            exts_filter=exts_filter,
+        )
+        return (meta.root, hits)
+
+    def close(self) -> None:
+        self.con.close()
+
+    def __enter__(self) -> "SearchContext":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+
+# search() keeps recently used indexes open between calls. SQLite connections
+# belong to the thread that opened them, so contexts are keyed per thread.
+_MAX_CACHED_CONTEXTS = 8
+_contexts: "OrderedDict[Tuple[str, int], SearchContext]" = OrderedDict()
+_contexts_lock = threading.Lock()
+
+
+def _cached_context(db_path: Path) -> SearchContext:
+    key = (os.path.abspath(db_path), threading.get_ident())
+    with _contexts_lock:
+        ctx = _contexts.get(key)
+        if ctx is not None:
+            _contexts.move_to_end(key)
+            return ctx
+    ctx = SearchContext(Path(key[0]))
+    evicted: List[SearchContext] = []
+    with _contexts_lock:
+        _contexts[key] = ctx
+        while len(_contexts) > _MAX_CACHED_CONTEXTS:
+            evicted.append(_contexts.popitem(last=False)[1])
+    for old in evicted:
+        _close_quietly(old)
+    return ctx
+
+
+def _close_quietly(ctx: SearchContext) -> None:
+    try:
+        ctx.close()
+    except sqlite3.Error:
+        # Opened by another (possibly finished) thread; let it be collected.
+        pass
+
+
+def close_all() -> None:
+    """Close every index connection search() is keeping open."""
+    with _contexts_lock:
+        ctxs = list(_contexts.values())
+        _contexts.clear()
+    for ctx in ctxs:
+        _close_quietly(ctx)
+
+
+atexit.register(close_all)
+
+
 def search(
     *,
     db_path: Path,
     query: str,
     k: int = 10,
-    k1: float = 1.2,
-    b: float = 0.75,
+    k1: float = DEFAULT_K1,
+    b: float = DEFAULT_B,
     stem: bool = False,
     stopwords: bool = True,
     path_boost: float = 1.5,
     path_filter: Optional[str] = None,
-    exts_filter: Optional[set[str]] = None,
+    exts_filter: Optional[AbstractSet[str]] = None,
 ) -> Tuple[str, List[SearchHit]]:
-    con = _connect(Path(db_path))
-    init_db(con)
-    root = _get_meta(con, "root", ".")
-    total_docs = int(_get_meta(con, "total_docs", "0") or "0")
-    avgdl = float(_get_meta(con, "avgdl", "0") or "0") or 1.0
-    if total_docs <= 0:
-        con.close()
-        return (root, [])
+    return _cached_context(db_path).search(
+        query,
+        k=k,
+        k1=k1,
+        b=b,
+        stem=stem,
+        stopwords=stopwords,
+        path_boost=path_boost,
+        path_filter=path_filter,
+        exts_filter=exts_filter,
+    )
+
+
+def search_batch(
+    *,
+    db_path: Path,
+    queries: Sequence[str],
+    k: int = 10,
+    k1: float = DEFAULT_K1,
+    b: float = DEFAULT_B,
+    stem: bool = False,
+    stopwords: bool = True,
+    path_boost: float = 1.5,
+    path_filter: Optional[str] = None,
+    exts_filter: Optional[AbstractSet[str]] = None,
+) -> Tuple[str, List[List[SearchHit]]]:
+    """
+    Run several queries against one index, returning one hit list per query.
+
+    The connection and index metadata are loaded once and shared by every
+    query, so scripted workloads don't pay the open/init cost per search.
+    """
+    ctx = _cached_context(db_path)
+    results = [
+        ctx.search(
+            query,
+            k=k,
+            k1=k1,
+            b=b,
+            stem=stem,
+            stopwords=stopwords,
+            path_boost=path_boost,
+            path_filter=path_filter,
+            exts_filter=exts_filter,
+        )[1]
+        for query in queries
+    ]
+    return (ctx.root, results)
+
+
+@dataclass(frozen=True)
+class _SearchMeta:
+    root: str
+    total_docs: int
+    avgdl: float
+    # (k1, b) the docs.norm column was computed for, if any.
+    norm_params: Optional[Tuple[float, float]]
+    # term -> (term_id, idf), or None for terms not in the index. Filled by
+    # searches; a new _SearchMeta is loaded whenever the index changes.
+    terms: Dict[str, Optional[Tuple[int, float]]] = field(default_factory=dict, compare=False)
+
+
+# Bound on _SearchMeta.terms, so a long-lived context can't grow without limit.
+_MAX_CACHED_TERMS = 4096
+
+
+def _search_meta(con: sqlite3.Connection, db_path: Path) -> _SearchMeta:
+    if not _check_schema(con, db_path):
+        return _SearchMeta(root=".", total_docs=0, avgdl=1.0, norm_params=None)
+    norm_k1 = _get_meta(con, "norm_k1", "")
+    norm_b = _get_meta(con, "norm_b", "")
+    return _SearchMeta(
+        root=_get_meta(con, "root", "."),
+        total_docs=int(_get_meta(con, "total_docs", "0") or "0"),
+        avgdl=float(_get_meta(con, "avgdl", "0") or "0") or 1.0,
+        norm_params=(float(norm_k1), float(norm_b)) if norm_k1 and norm_b else None,
+    )
 
-    sw = DEFAULT_STOPWORDS if stopwords else set()
 
-    # Support | alternation: split on |, tokenize each part, and also
-    # regex-match raw alternatives against the terms table.
+def _search_con(
+    con: sqlite3.Connection,
+    query: str,
+    meta: _SearchMeta,
+    *,
+    k: int,
+    k1: float,
+    b: float,
+    stem: bool,
+    stopwords: bool,
+    path_boost: float,
+    path_filter: Optional[str],
+    exts_filter: Optional[AbstractSet[str]],
+) -> List[SearchHit]:
+    sw = DEFAULT_STOPWORDS if stopwords else _EMPTY_SW
+
+    # Support | alternation: split on |, tokenize each part, and also look up
+    # each lowered alternative as-is to catch exact tokens (e.g. "load|parse").
+    # Alternatives that aren't index terms drop out in the IN () lookup below.
     if "|" in query:
         alternatives = [a.strip() for a in query.split("|") if a.strip()]
         q_terms: List[str] = []
         for alt in alternatives:
             q_terms.extend(tokenize(alt, stem=stem, stopwords=sw))
-        # Also regex-match the lowered alternatives directly against index terms
-        # to catch cases where the user typed exact tokens (e.g. "load|parse").
-        try:
-            pat = "|".join(re.escape(a.lower()) for a in alternatives if a)
-            rx = re.compile(pat)
-            for row in con.execute("SELECT term FROM terms"):
-                t = str(row[0])
-                if rx.fullmatch(t) and t not in q_terms:
-                    q_terms.append(t)
-        except re.error:
-            pass
+        q_terms.extend(a.lower() for a in alternatives)
         # Deduplicate while preserving order.
         seen: set[str] = set()
         deduped: List[str] = []
@@ -754,78 +1270,134 @@ def search(
         q_terms = tokenize(query, stem=stem, stopwords=sw)
 
     if not q_terms:
-        con.close()
-        return (root, [])
-
-    doc_scores: Dict[int, float] = defaultdict(float)
-    doc_paths: Dict[int, str] = {}
-    doc_lens: Dict[int, int] = {}
-    doc_path_tokens: Dict[int, set[str]] = {}
-
+        if not query.strip() and (path_filter or exts_filter):
+            return _list_docs(con, k=k, path_filter=path_filter, exts_filter=exts_filter)
+        return []
+
+    # One (term_id, weight, pattern) row per query term that exists in the
+    # index. The weight folds idf and (k1 + 1); the pattern is the space-padded
+    # term used for the path-boost check against the padded path_tokens column.
+    # Terms not seen since the index last changed are resolved in one IN ()
+    # lookup; rows keep query order.
+    found = meta.terms
+    missing = [t for t in dict.fromkeys(q_terms) if t not in found]
+    if missing:
+        if len(found) + len(missing) > _MAX_CACHED_TERMS:
+            found.clear()
+        marks = ",".join("?" for _ in missing)
+        found.update(dict.fromkeys(missing))
+        for term, term_id, idf in con.execute(f"SELECT term, term_id, idf FROM terms WHERE term IN ({marks})", missing):
+            found[str(term)] = (int(term_id), float(idf))
+    q_rows: List[Tuple[int, float, str]] = []
     for term in q_terms:
-        row = con.execute("SELECT df FROM terms WHERE term=?", (term,)).fetchone()
-        if not row:
-            continue
-        df = int(row[0])
-        idf = bm25_idf(total_docs, df)
-
-        # Pull postings joined with doc metadata in one query (avoid N+1).
-        if path_filter:
-            q = """
-                SELECT p.docid, p.tf, d.path, d.len, d.path_tokens
-                FROM postings p
-                JOIN docs d ON d.docid = p.docid
-                WHERE p.term = ? AND d.path LIKE ?
-            """
-            params = (term, f"%{path_filter}%")
-        else:
-            q = """
-                SELECT p.docid, p.tf, d.path, d.len, d.path_tokens
-                FROM postings p
-                JOIN docs d ON d.docid = p.docid
-                WHERE p.term = ?
-            """
-            params = (term,)
-
-        for docid, tf, path, dlen, path_tokens in con.execute(q, params):
-            docid = int(docid)
-            tf = int(tf)
-            p = str(path)
-            if exts_filter:
-                suf = Path(p).suffix.lower()
-                if (Path(p).name.lower() not in exts_filter) and (suf not in exts_filter):
-                    continue
-            if docid not in doc_lens:
-                doc_paths[docid] = p
-                doc_lens[docid] = int(dlen)
-                doc_path_tokens[docid] = set(str(path_tokens).split())
-
-            dl = doc_lens[docid] or 1
-            denom = tf + k1 * (1.0 - b + b * (dl / avgdl))
-            score = idf * (tf * (k1 + 1.0)) / denom
-            if term in doc_path_tokens.get(docid, ()):
-                score *= path_boost
-            doc_scores[docid] += score
-
-    if not doc_scores:
-        con.close()
-        return (root, [])
-
-    top = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)[:k]
-    hits = [SearchHit(score=float(score), path=doc_paths.get(docid, ""), docid=int(docid)) for docid, score in top]
-    con.close()
-    return (root, hits)
+        hit = found.get(term)
+        if hit is not None:
+            term_id, idf = hit
+            q_rows.append((term_id, idf * (k1 + 1.0), f" {term} "))
+
+    if not q_rows:
+        return []
+
+    params: List[object] = [x for r in q_rows for x in r]
+    if meta.norm_params == (k1, b):
+        # k1*(1 - b + b*dl/avgdl) was baked into docs.norm at index time.
+        norm = "d.norm"
+    elif b == 0.0:
+        # No length normalization: the denominator is just tf + k1.
+        norm = "?"
+        params.append(k1)
+    else:
+        # Loop-invariant parts of the BM25 denominator, computed once per query:
+        #   tf + k1*(1 - b + b*dl/avgdl) == tf + norm_a + norm_b*dl
+        norm = "(? + ? * MAX(d.len, 1))"
+        params.extend((k1 * (1.0 - b), k1 * b / meta.avgdl))
+    # The path check is the most expensive part of scoring a posting; a boost
+    # of 1.0 cannot change any score, so it is left out of the statement.
+    boost = ""
+    if path_boost != 1.0:
+        boost = "* (CASE WHEN instr(d.path_tokens, q.pat) > 0 THEN ? ELSE 1.0 END)"
+        params.append(path_boost)
+
+    # Score every query term in a single statement: the per-posting arithmetic
+    # and the per-doc sum across terms both run inside SQLite, so Python only
+    # sees one (docid, path, score) row per candidate doc.
+    values = ",".join("(?,?,?)" for _ in q_rows)
+    q = f"""
+        WITH q(term_id, w, pat) AS (VALUES {values})
+        SELECT p.docid, d.path,
+               SUM(q.w * p.tf / (p.tf + {norm}) {boost})
+        FROM q
+        JOIN postings p ON p.term_id = q.term_id
+        JOIN docs d ON d.docid = p.docid
+    """
+    # Doc filters are plain predicates on the docs side of the join, so they
+    # cut candidates before any posting is scored or returned to Python.
+    where = _doc_filters(path_filter, exts_filter, params)
+    if where:
+        q += " WHERE " + " AND ".join(where)
+    # With a LIMIT, SQLite's sorter only retains the best k rows, so top-k
+    # selection never materializes the full candidate list. docid breaks ties
+    # so equal scores keep a stable order.
+    q += " GROUP BY p.docid ORDER BY 3 DESC, p.docid LIMIT ?"
+    params.append(max(k, 0))
+
+    return [
+        SearchHit(score=float(score), path=str(path), docid=int(docid))
+        for docid, path, score in con.execute(q, params)
+    ]
+
+
+def _doc_filters(
+    path_filter: Optional[str], exts_filter: Optional[AbstractSet[str]], params: List[object]
+) -> List[str]:
+    # WHERE predicates on docs `d` for the search filters; appends their params.
+    where: List[str] = []
+    if path_filter:
+        # A plain substring match: escape LIKE's own wildcards so paths such as
+        # "my_module/" don't also match "myXmodule/".
+        escaped = path_filter.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        where.append("d.path LIKE ? ESCAPE '\\'")
+        params.append(f"%{escaped}%")
+    if exts_filter:
+        exts = sorted(exts_filter)
+        marks = ",".join("?" for _ in exts)
+        where.append(f"(d.ext IN ({marks}) OR d.name IN ({marks}))")
+        params.extend(exts)
+        params.extend(exts)
+    return where
+
+
+def _list_docs(
+    con: sqlite3.Connection,
+    *,
+    k: int,
+    path_filter: Optional[str],
+    exts_filter: Optional[AbstractSet[str]],
+) -> List[SearchHit]:
+    # An empty query with filters lists the matching docs in path order, all
+    # scored 0. Walking the path index in order stops after k matches, and no
+    # postings are touched.
+    params: List[object] = []
+    where = _doc_filters(path_filter, exts_filter, params)
+    params.append(max(k, 0))
+    q = f"SELECT d.docid, d.path FROM docs d WHERE {' AND '.join(where)} ORDER BY d.path LIMIT ?"
+    return [SearchHit(score=0.0, path=str(path), docid=int(docid)) for docid, path in con.execute(q, params)]
 
 
 def snippet_with_line(path: Path, terms: Sequence[str], max_len: int = 220) -> Tuple[Optional[int], str]:
-    text = read_text(path)
+    return snippet_from_text(read_text(path), terms, max_len=max_len)
+
+
+def snippet_from_text(text: str, terms: Sequence[str], max_len: int = 220) -> Tuple[Optional[int], str]:
     if not text:
         return (None, "")
     lower = text.lower()
     pos = None
     for t in terms:
-        p = lower.find(t)
-        if p != -1 and (pos is None or p < pos):
+        # Once some term matched, later terms only matter if they start before
+        # it, so bound each find() instead of rescanning the whole text.
+        p = lower.find(t) if pos is None else lower.find(t, 0, pos + len(t) - 1)
+        if p != -1:
             pos = p
     if pos is None:
         line = text.splitlines()[0] if text else ""
@@ -847,20 +1419,37 @@ def snippet_with_line(path: Path, terms: Sequence[str], max_len: int = 220) -> T
     return (line_no, re.sub(r"\s+", " ", line))
 
 
-def highlight(s: str, terms: Sequence[str], *, color: bool) -> str:
-    if not color or not terms:
-        return s
-    # Simple case-insensitive highlight.
-    out = s
-    for t in sorted(set(terms), key=len, reverse=True):
-        if len(t) < 2:
-            continue
-        out = re.sub(
-            re.escape(t),
-            lambda m: f"\x1b[1;31m{m.group(0)}\x1b[0m",
-            out,
-            flags=re.IGNORECASE,
-        )
-    return out
+def terms_pattern(terms: Sequence[str]) -> Optional[re.Pattern[str]]:
+    """
+    Compile query terms into one case-insensitive alternation, longest first,
+    so a single scan finds every match. Returns None if no term is usable.
+    """
+    return _compile_terms(frozenset(t for t in terms if len(t) >= 2))
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_terms(uniq: AbstractSet[str]) -> Optional[re.Pattern[str]]:
+    # Cached per distinct term set, so repeated queries (search-batch, the
+    # daemon) reuse the compiled pattern. Ties in length sort alphabetically
+    # to keep the pattern independent of set iteration order.
+    if not uniq:
+        return None
+    ordered = sorted(uniq, key=lambda t: (-len(t), t))
+    return re.compile("|".join(re.escape(t) for t in ordered), re.IGNORECASE)
 
 
+def highlight(
+    s: str,
+    terms: Sequence[str],
+    *,
+    color: bool,
+    pattern: Optional[re.Pattern[str]] = None,
+) -> str:
+    if not color or not terms:
+        return s
+    # Simple case-insensitive highlight, one pass over the string. Callers that
+    # highlight many snippets for one query can pass terms_pattern(terms).
+    rx = pattern if pattern is not None else terms_pattern(terms)
+    if rx is None:
+        return s
+    return rx.sub(lambda m: f"\x1b[1;31m{m.group(0)}\x1b[0m", s)
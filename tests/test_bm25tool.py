@@ -1,9 +1,15 @@
 import os
+import socket
+import sqlite3
 import tempfile
+import threading
 import unittest
+from collections import Counter
 from pathlib import Path
 
 import bm25tool
+from sx_search import daemon
+from sx_search import engine
 
 
 class TestBM25Tool(unittest.TestCase):
@@ -67,6 +73,224 @@ class TestBM25Tool(unittest.TestCase):
             self.assertEqual(stats3["indexed"], 1)
             self.assertEqual(stats3["unchanged"], 1)
 
+    def test_incremental_sees_same_size_edit(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            a = root / "a.txt"
+            a.write_text("alpha", encoding="utf-8")
+            t = os.stat(a).st_mtime_ns // 10**9 * 10**9
+            os.utime(a, ns=(t, t))
+            db = root / "idx.sqlite"
+            opts = bm25tool.IndexOptions(exts={".txt"}, workers=1)
+            bm25tool.index(db_path=db, root=root, opts=opts, incremental=True)
+            # Same size, same whole second: only the sub-second mtime moves.
+            a.write_text("gamma", encoding="utf-8")
+            os.utime(a, ns=(t + 5000, t + 5000))
+            if os.stat(a).st_mtime_ns == t:
+                self.skipTest("filesystem has no sub-second mtimes")
+            stats = bm25tool.index(db_path=db, root=root, opts=opts, incremental=True)
+            self.assertEqual(stats["indexed"], 1)
+
+    def test_interrupted_write_is_redone(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            (root / "a.txt").write_text("hello world", encoding="utf-8")
+            db = root / "idx.sqlite"
+            opts = bm25tool.IndexOptions(exts={".txt"}, workers=1)
+            bm25tool.index(db_path=db, root=root, opts=opts, incremental=True)
+            (root / "b.txt").write_text("fresh content", encoding="utf-8")
+
+            def boom(n_docs: int, df: int) -> float:
+                raise RuntimeError("interrupted")
+
+            real = engine.bm25_idf
+            engine.bm25_idf = boom
+            try:
+                with self.assertRaises(Exception):
+                    bm25tool.index(db_path=db, root=root, opts=opts, incremental=True)
+            finally:
+                engine.bm25_idf = real
+            # Nothing of the failed run was kept, so b.txt is picked up again.
+            stats = bm25tool.index(db_path=db, root=root, opts=opts, incremental=True)
+            self.assertEqual(stats["indexed"], 1)
+            _, hits = bm25tool.search(db_path=db, query="fresh", k=10)
+            self.assertEqual([h.path for h in hits], ["b.txt"])
+            self.assertGreater(hits[0].score, 0.0)
+            bm25tool.close_all()
+
+    def test_search_batch_matches_search(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            (root / "a.txt").write_text("redis replication backlog backlog", encoding="utf-8")
+            (root / "b.txt").write_text("append only file aof fsync", encoding="utf-8")
+            db = root / "idx.sqlite"
+            bm25tool.index(
+                db_path=db,
+                root=root,
+                opts=bm25tool.IndexOptions(exts={".txt"}, workers=4),
+                incremental=True,
+            )
+            queries = ["replication backlog", "aof|fsync", "zzz"]
+            _, results = bm25tool.search_batch(db_path=db, queries=queries, k=10)
+            self.assertEqual(len(results), len(queries))
+            for q, hits in zip(queries, results):
+                _, single = bm25tool.search(db_path=db, query=q, k=10)
+                self.assertEqual([h.path for h in hits], [h.path for h in single])
+            self.assertEqual(results[2], [])
+
+    def test_search_sees_reindex(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            (root / "a.txt").write_text("hello world", encoding="utf-8")
+            db = root / "idx.sqlite"
+            opts = bm25tool.IndexOptions(exts={".txt"}, workers=1)
+            bm25tool.index(db_path=db, root=root, opts=opts, incremental=True)
+            _, hits = bm25tool.search(db_path=db, query="fresh", k=10)
+            self.assertEqual(hits, [])
+            # search() keeps the index open; it must still notice the update.
+            (root / "b.txt").write_text("fresh content", encoding="utf-8")
+            bm25tool.index(db_path=db, root=root, opts=opts, incremental=True)
+            _, hits = bm25tool.search(db_path=db, query="fresh", k=10)
+            self.assertEqual([h.path for h in hits], ["b.txt"])
+            bm25tool.close_all()
+
+    def test_search_leaves_other_versions_intact(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            (root / "a.txt").write_text("hello world", encoding="utf-8")
+            db = root / "idx.sqlite"
+            opts = bm25tool.IndexOptions(exts={".txt"}, workers=1)
+            bm25tool.index(db_path=db, root=root, opts=opts, incremental=True)
+            con = sqlite3.connect(str(db))
+            con.execute("UPDATE meta SET v='0' WHERE k='version'")
+            con.commit()
+            con.close()
+            other = root / "other.sqlite"
+            con = sqlite3.connect(str(other))
+            con.execute("CREATE TABLE docs (x)")
+            con.commit()
+            con.close()
+
+            for path in (db, other):
+                with self.assertRaises(bm25tool.IndexVersionError):
+                    bm25tool.search(db_path=path, query="hello", k=10)
+                status = bm25tool.index_status(db_path=path, cwd=root)
+                self.assertFalse(status["indexed"])
+                self.assertIn("sx index", status["reason"])
+            bm25tool.close_all()
+            con = sqlite3.connect(str(db))
+            self.assertEqual(con.execute("SELECT COUNT(*) FROM docs").fetchone()[0], 1)
+            con.close()
+            con = sqlite3.connect(str(other))
+            self.assertEqual(con.execute("SELECT name FROM sqlite_master").fetchall(), [("docs",)])
+            con.close()
+
+            bm25tool.index(db_path=db, root=root, opts=opts, incremental=True)
+            _, hits = bm25tool.search(db_path=db, query="hello", k=10)
+            self.assertEqual([h.path for h in hits], ["a.txt"])
+            bm25tool.close_all()
+
+    def test_index_refuses_foreign_database(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            (root / "a.txt").write_text("hello world", encoding="utf-8")
+            other = root / "app.sqlite"
+            con = sqlite3.connect(str(other))
+            con.execute("CREATE TABLE docs (x)")
+            con.execute("INSERT INTO docs VALUES (1)")
+            con.commit()
+            con.close()
+            with self.assertRaises(bm25tool.IndexVersionError):
+                bm25tool.index(
+                    db_path=other,
+                    root=root,
+                    opts=bm25tool.IndexOptions(exts={".txt"}, workers=1),
+                    incremental=True,
+                )
+            con = sqlite3.connect(str(other))
+            self.assertEqual(con.execute("SELECT x FROM docs").fetchall(), [(1,)])
+            self.assertEqual(con.execute("SELECT name FROM sqlite_master").fetchall(), [("docs",)])
+            con.close()
+
+    @unittest.skipUnless(engine._START_METHODS[0] == "fork", "needs fork-started workers")
+    def test_dead_worker_falls_back_to_threads(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            n = engine._PROCESS_POOL_MIN_TASKS * 3
+            for i in range(n):
+                (root / f"f{i:03d}.txt").write_text(f"alpha beta file{i}", encoding="utf-8")
+            parent = os.getpid()
+            real = engine._index_one_file
+
+            def dying(cfg: "engine._IndexConfig", rel: str) -> "engine._IndexedDoc | None":
+                # Forked workers inherit this patch; one of them dies mid-run.
+                if rel == "f005.txt" and os.getpid() != parent:
+                    os._exit(1)
+                return real(cfg, rel)
+
+            engine._index_one_file = dying
+            try:
+                stats = bm25tool.index(
+                    db_path=root / "idx.sqlite",
+                    root=root,
+                    opts=bm25tool.IndexOptions(exts={".txt"}, workers=2),
+                    incremental=True,
+                )
+            finally:
+                engine._index_one_file = real
+            self.assertEqual(stats["indexed"], n)
+            self.assertEqual(stats["failed"], 0)
+
+    @unittest.skipUnless(daemon.available(), "needs Unix-domain sockets")
+    def test_daemon_remote_search(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            (root / "a.txt").write_text("redis replication backlog backlog", encoding="utf-8")
+            (root / "b.txt").write_text("append only file aof fsync", encoding="utf-8")
+            db = root / "idx.sqlite"
+            bm25tool.index(
+                db_path=db,
+                root=root,
+                opts=bm25tool.IndexOptions(exts={".txt"}, workers=4),
+                incremental=True,
+            )
+            sock = str(root / "s.sock")
+            server = daemon.make_server(sock)
+
+            def serve() -> None:
+                # Contexts are opened on the serving thread; close them there too.
+                try:
+                    server.serve_forever()
+                finally:
+                    server.server_close()
+
+            t = threading.Thread(target=serve, daemon=True)
+            t.start()
+            # A client that connects and never sends must not hold up others.
+            idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            idle.connect(sock)
+            try:
+                res = daemon.remote_search(
+                    sock,
+                    db_path=db,
+                    query="replication aof",
+                    k=10,
+                    k1=1.2,
+                    b=0.75,
+                    stem=False,
+                    stopwords=True,
+                    path_boost=1.5,
+                    path_filter=None,
+                    exts_filter=None,
+                )
+            finally:
+                idle.close()
+                server.shutdown()
+                t.join()
+            self.assertIsNotNone(res)
+            _, local = bm25tool.search(db_path=db, query="replication aof", k=10)
+            self.assertEqual([h.path for h in res[1]], [h.path for h in local])
+
 
 class TestAlternation(unittest.TestCase):
     def test_pipe_search(self) -> None:
@@ -143,6 +367,113 @@ class TestAlternation(unittest.TestCase):
             self.assertIn("src", hits[0].path)
 
 
+class TestSearch(unittest.TestCase):
+    def test_path_filter_is_literal(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            for d in ("my_mod", "myXmod", "100%"):
+                (root / d).mkdir()
+                (root / d / "a.c").write_text("ACLLoad here\n", encoding="utf-8")
+            db = root / "idx.sqlite"
+            bm25tool.index(
+                db_path=db,
+                root=root,
+                opts=bm25tool.IndexOptions(exts={".c"}, workers=1),
+                incremental=True,
+            )
+            for flt, want in (("my_mod/", "my_mod/a.c"), ("0%/", "100%/a.c")):
+                _, hits = bm25tool.search(db_path=db, query="ACLLoad", k=10, path_filter=flt)
+                self.assertEqual([h.path for h in hits], [want])
+
+    def test_empty_query_lists_filtered_paths(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            (root / "src").mkdir()
+            (root / "src" / "b.c").write_text("ACLLoad here\n", encoding="utf-8")
+            (root / "src" / "a.h").write_text("ACLSetUser\n", encoding="utf-8")
+            (root / "other.c").write_text("ACLLoad there\n", encoding="utf-8")
+            db = root / "idx.sqlite"
+            bm25tool.index(
+                db_path=db,
+                root=root,
+                opts=bm25tool.IndexOptions(exts={".c", ".h"}, workers=1),
+                incremental=True,
+            )
+            _, hits = bm25tool.search(db_path=db, query="", k=10, path_filter="src/")
+            self.assertEqual([h.path for h in hits], ["src/a.h", "src/b.c"])
+            _, hits = bm25tool.search(db_path=db, query=" ", k=1, exts_filter={".c"})
+            self.assertEqual([h.path for h in hits], ["other.c"])
+            # Without a filter an empty query still matches nothing.
+            _, hits = bm25tool.search(db_path=db, query="", k=10)
+            self.assertEqual(hits, [])
+
+    def test_top_k_is_prefix_of_full_ranking(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            for i in range(1, 8):
+                (root / f"d{i}.txt").write_text(("needle " * i) + "filler " * (10 - i), encoding="utf-8")
+            db = root / "idx.sqlite"
+            bm25tool.index(
+                db_path=db,
+                root=root,
+                opts=bm25tool.IndexOptions(exts={".txt"}, workers=1),
+                incremental=True,
+            )
+            _, full = bm25tool.search(db_path=db, query="needle", k=100)
+            _, top = bm25tool.search(db_path=db, query="needle", k=3)
+            self.assertEqual(len(full), 7)
+            self.assertEqual([h.path for h in top], [h.path for h in full[:3]])
+            scores = [h.score for h in full]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+            self.assertEqual(full[0].path, "d7.txt")
+
+    def test_rare_term_outweighs_common_term(self) -> None:
+        # Each term is weighted by its own idf: many "the"s can't beat "sun".
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            (root / "the.txt").write_text("the " * 8 + "cat", encoding="utf-8")
+            (root / "sun.txt").write_text("the sun sun moon", encoding="utf-8")
+            (root / "dog.txt").write_text("the dog", encoding="utf-8")
+            (root / "bird.txt").write_text("the bird", encoding="utf-8")
+            db = root / "idx.sqlite"
+            bm25tool.index(
+                db_path=db,
+                root=root,
+                opts=bm25tool.IndexOptions(exts={".txt"}, stopwords=False, workers=1),
+                incremental=True,
+            )
+            _, hits = bm25tool.search(db_path=db, query="the sun", k=10, stopwords=False, path_boost=1.0)
+            self.assertEqual(len(hits), 4)
+            self.assertEqual(hits[0].path, "sun.txt")
+            self.assertLess(hits[1].score, hits[0].score / 2)
+
+
+class TestTokenize(unittest.TestCase):
+    def test_tokenize_splits_identifiers(self) -> None:
+        self.assertEqual(
+            bm25tool.tokenize("RedisModule_Load HTTPConnection utf8 x_y2 sha256sum"),
+            ["redis", "module", "load", "httpconnection", "utf", "sha", "256", "sum"],
+        )
+
+    def test_tokenize_count_matches_tokenize(self) -> None:
+        text = "Loading loaders load_loaded LoadLoads the THE parser parsers"
+        for stem in (False, True):
+            for sw in (bm25tool.DEFAULT_STOPWORDS, frozenset()):
+                toks = bm25tool.tokenize(text, stem=stem, stopwords=sw)
+                dl, tf = bm25tool.tokenize_count(text, stem=stem, stopwords=sw)
+                self.assertEqual(dl, len(toks))
+                self.assertEqual(tf, dict(Counter(toks)))
+
+    def test_byte_tokenizer_matches_decoded_text(self) -> None:
+        from sx_search.engine import _count_subtokens_bytes, _finish_counts
+
+        data = "caf\u00e9Load x\u20acHTTPServer_v2 na\u00efve".encode("utf-8") + b"\xffBad\xe2Seq 42"
+        self.assertEqual(
+            _finish_counts(_count_subtokens_bytes(data), False, None),
+            bm25tool.tokenize_count(data.decode("utf-8", errors="replace")),
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
 